@@ -1,8 +1,15 @@
 import os
-import shlex
 import subprocess
+import tempfile
+from collections.abc import Iterable, Iterator
 from dataclasses import dataclass
 from enum import Enum, auto
+from pathlib import Path
+from typing import BinaryIO
+
+# Stop commands like `git status` from refreshing the index on disk, so that they never take the index lock and
+# conflict with another build (or the user's own git commands) running against the same repository
+GIT_CMD = ("git", "--no-optional-locks")
 
 
 class FileStatus(Enum):
@@ -12,34 +19,60 @@ class FileStatus(Enum):
     DELETED = auto()
     RENAMED = auto()
     COPIED = auto()
+    IGNORED = auto()
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class GitStatusEntry:
     status: FileStatus
     filepath: str
     original_filepath: str | None = None  # For renamed/copied files
 
 
-def _unquote_filepath(filepath: str) -> str:
-    """
-    Unquote a filepath from git status output.
+def _decode_filepath(filepath: bytes) -> str:
+    """Decode a filepath from git, using surrogateescape so that non-UTF-8 filenames survive the round trip."""
+    return filepath.decode("utf-8", "surrogateescape")
+
+
+def _split_records(stream: BinaryIO) -> Iterator[bytes]:
+    """Split a stream of NUL-terminated records (the output of a git command run with `-z`) as it is read."""
+    pending = b""
+    while chunk := stream.read1():
+        *records, pending = (pending + chunk).split(b"\0")
+        yield from records
+    if pending:
+        yield pending
 
-    Git quotes filenames that contain spaces or special characters.
-    This function handles the unquoting using shlex.
-    """
-    # Use shlex to properly unquote the string
-    return shlex.split(filepath)[0]
 
+# Worktree (second column) status codes we report, and the index (first column) ones that apply when the worktree
+# status isn't one of these
+_WORKTREE_STATUSES = {
+    "M": FileStatus.MODIFIED,
+    "D": FileStatus.DELETED,
+    "R": FileStatus.RENAMED,
+    "C": FileStatus.COPIED,
+    "!": FileStatus.IGNORED,  # Only reported when asked for with `--ignored`
+}
+_INDEX_RENAME_STATUSES = {
+    "R": FileStatus.RENAMED,
+    "C": FileStatus.COPIED,
+}
 
-def parse_git_status_porcelain(output: str) -> list[GitStatusEntry]:
+
+def parse_git_status_porcelain(output: bytes) -> list[GitStatusEntry]:
+    """Parse git status --porcelain=v1 -z output and return modified/untracked files."""
+    return list(iter_git_status_porcelain(output.split(b"\0")))
+
+
+def iter_git_status_porcelain(records: Iterable[bytes]) -> Iterator[GitStatusEntry]:
     """
-    Parse git status --porcelain=v1 output and return modified/untracked files.
+    Parse the NUL-separated records of git status --porcelain=v1 -z output, yielding modified/untracked files.
 
-    Git status --porcelain=v1 format:
+    Git status --porcelain=v1 -z format, one record per file:
     - First character: index status
     - Second character: worktree status
-    - Rest: filepath (with optional -> for renames)
+    - Rest: filepath, exactly as it is on disk (-z turns off git's quoting)
+    - For renames and copies, the original filepath follows as a record of its own
 
     We care about:
     - Modified files (M in worktree position)
@@ -48,68 +81,123 @@ def parse_git_status_porcelain(output: str) -> list[GitStatusEntry]:
 
     We ignore:
     - Fully staged files (status in index position only, worktree clean)
-    """
-    entries = []
 
-    for line in output.split("\n"):
-        if not line:
+    The output is taken as bytes so that only the filepaths we keep are decoded.
+    """
+    records = iter(records)
+    for record in records:
+        if not record:
+            # The empty string after the final NUL
             continue
 
         # Parse the two-character status code
-        index_status = line[0]
-        worktree_status = line[1]
-        filepath_part = line[3:]  # Skip the two status chars and space
+        index_status = chr(record[0])
+        worktree_status = chr(record[1])
+
+        # The original path of a rename/copy is in the next record, which we must consume even if we skip this entry
+        original = next(records) if index_status in "RC" or worktree_status in "RC" else None
 
         # Skip fully staged files (index has changes, worktree is clean)
         if index_status != " " and worktree_status == " ":
             continue
 
-        original = None
-        if " -> " in filepath_part:
-            original, filepath_part = filepath_part.split(" -> ", 1)
-            original = _unquote_filepath(original)
-        filepath_part = _unquote_filepath(filepath_part)
-
-        # Handle untracked files
-        match (index_status, worktree_status):
-            case ("?", "?"):
-                entries.append(GitStatusEntry(status=FileStatus.UNTRACKED, filepath=filepath_part))
-            case (_, "M"):
-                entries.append(GitStatusEntry(status=FileStatus.MODIFIED, filepath=filepath_part, original_filepath=original))
-            case (_, "D"):
-                entries.append(GitStatusEntry(status=FileStatus.DELETED, filepath=filepath_part))
-            case (_, "R"):
-                entries.append(GitStatusEntry(status=FileStatus.RENAMED, filepath=filepath_part, original_filepath=original))
-            case ("R", wt) if wt != " ":
-                entries.append(GitStatusEntry(status=FileStatus.RENAMED, filepath=filepath_part, original_filepath=original))
-            case (_, "C"):
-                entries.append(GitStatusEntry(status=FileStatus.COPIED, filepath=filepath_part, original_filepath=original))
-            case ("C", wt) if wt != " ":
-                entries.append(GitStatusEntry(status=FileStatus.COPIED, filepath=filepath_part, original_filepath=original))
-
-    return entries
+        # Decide whether we want the entry before doing any work on the path. A rename/copy in the index keeps that
+        # status unless the worktree status says otherwise. Anything else (e.g. `UU` for a conflict) is ignored
+        if index_status == "?":
+            status = FileStatus.UNTRACKED
+        else:
+            status = _WORKTREE_STATUSES.get(worktree_status) or _INDEX_RENAME_STATUSES.get(index_status)
+            if status is None:
+                continue
+
+        yield GitStatusEntry(
+            status=status,
+            filepath=_decode_filepath(record[3:]),  # Skip the two status chars and space
+            original_filepath=_decode_filepath(original) if original is not None else None,
+        )
 
 
-def get_modified_and_untracked_files(repo_path: str | os.PathLike = ".") -> list[GitStatusEntry]:
+def get_modified_and_untracked_files(
+    repo_path: str | os.PathLike = ".", *pathspecs: str | os.PathLike, ignored: bool = False, untracked_files: str = "normal"
+) -> list[GitStatusEntry]:
     """
     Get modified and untracked files from git status.
 
+    This runs `git status -z` and parses its output.
+
     Args:
         repo_path: Path to the git repository (default: current directory)
+        pathspecs: Only report files under these paths, relative to `repo_path` (default: the whole repository)
+        ignored: Also return ignored files, with a status of FileStatus.IGNORED
+        untracked_files: "normal" reports a wholly untracked directory as one entry, "all" reports every file inside
+            it, as with `git status --untracked-files`
 
     Returns:
         List of GitStatusEntry objects for modified and untracked files
 
     Raises:
-        subprocess.CalledProcessError: If git command fails
+        RuntimeError: If reading the git status fails, including when git can't be run
+    """
+    args = [*GIT_CMD, "status", "--porcelain=v1", "-z", f"--untracked-files={untracked_files}"]
+    if ignored:
+        args.append("--ignored")
+    args += ["--", *map(os.fspath, pathspecs)]
+
+    # Parse the output as git writes it rather than buffering it all first. stderr goes to a file so that git can
+    # never block writing to it while we are reading stdout
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            with subprocess.Popen(args, cwd=repo_path, stdout=subprocess.PIPE, stderr=stderr) as proc:
+                entries = list(iter_git_status_porcelain(_split_records(proc.stdout)))
+        except OSError as e:
+            # e.g. git isn't installed
+            raise RuntimeError(f"Git command failed: {e}") from e
+        if proc.returncode:
+            stderr.seek(0)
+            error = subprocess.CalledProcessError(proc.returncode, args, stderr=stderr.read())
+            raise RuntimeError(f"Git command failed: {error.stderr.decode('utf-8', 'replace')}") from error
+    return entries
+
+
+def get_worktree_root(repo_path: str | os.PathLike = ".") -> Path:
+    """
+    Find the top of the git worktree containing `repo_path`, which the paths in git status are relative to.
+
+    This looks for the `.git` directory (or file, for linked worktrees and submodules) ourselves rather than running
+    `git rev-parse --show-toplevel`.
+
+    Raises:
+        RuntimeError: If `repo_path` is not inside a git worktree
     """
+    path = Path(repo_path).resolve()
+    for directory in (path, *path.parents):
+        if directory.joinpath(".git").exists():
+            return directory
+    raise RuntimeError(f"{os.fspath(repo_path)} is not in a git worktree")
+
+
+def checkout_files(repo_path: str | os.PathLike, *paths: str) -> None:
+    """
+    Restore files in the worktree to their state in the index, by running `git checkout -- <paths>`.
+
+    Args:
+        repo_path: Path to (somewhere inside) the git repository
+        paths: The files to restore, relative to the top of the worktree as git status reports them
+
+    Raises:
+        RuntimeError: If restoring the files fails
+    """
+    if not paths:
+        return
+
+    args = [*GIT_CMD, "checkout", "--", *(f":(top,literal){path}" for path in paths)]
     try:
-        result = subprocess.run(
-            ["git", "status", "--porcelain=v1", os.fspath(repo_path)], cwd=repo_path, capture_output=True, text=True, check=True
-        )
-        return parse_git_status_porcelain(result.stdout)
+        subprocess.run(args, cwd=repo_path, check=True, capture_output=True)
     except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"Git command failed: {e.stderr}") from e
+        raise RuntimeError(f"Git command failed: {e.stderr.decode('utf-8', 'replace')}") from e
+    except OSError as e:
+        # e.g. git isn't installed
+        raise RuntimeError(f"Git command failed: {e}") from e
 
 
 def filter_by_status(entries: list[GitStatusEntry], *statuses: FileStatus) -> list[GitStatusEntry]:
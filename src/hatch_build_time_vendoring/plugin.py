@@ -8,14 +8,48 @@ exist during the build process.
 
 import os
 import shutil
+import stat
 import subprocess
-from functools import wraps
+import threading
+from contextlib import suppress
+from functools import cache, cached_property, wraps
 from pathlib import Path
 from typing import Any
 
 from hatchling.builders.hooks.plugin.interface import BuildHookInterface
 
-from .git import FileStatus, filter_by_status, get_filepaths, get_modified_and_untracked_files
+from .git import (
+    GIT_CMD,
+    FileStatus,
+    GitStatusEntry,
+    checkout_files,
+    filter_by_status,
+    get_filepaths,
+    get_modified_and_untracked_files,
+    get_worktree_root,
+)
+
+_CHDIR_LOCK = threading.Lock()
+
+
+@cache
+def _which(name: str) -> str | None:
+    """Look up an executable on PATH, remembering the result for later builds in this process."""
+    return shutil.which(name)
+
+
+@cache
+def _load_pyproject(root: str) -> dict[str, Any]:
+    """Load a project's pyproject.toml, once per project even when building several targets in one process."""
+    # Imported here, so that builds which never get this far don't pay for it.
+    # Use tomli for Python < 3.11, otherwise use tomllib
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+
+    with Path(root, "pyproject.toml").open("rb") as f:
+        return tomllib.load(f)
 
 
 class VendoringBuildHook(BuildHookInterface):
@@ -24,12 +58,14 @@ class VendoringBuildHook(BuildHookInterface):
     PLUGIN_NAME = "vendoring"
 
     vendor_path: Path | None = None
-    vendor_dir: str | None
+    vendor_dir: str | None = None
     protected_files: list[str]
 
     def __init__(self, root: str, config: dict[str, Any], *args, **kwargs) -> None:
         super().__init__(root, config, *args, **kwargs)
         self.abort_on_changed_files = config.get("abort-on-changed-files", True)
+        # What vendoring changed in the vendor directory, so that finalize only has to clean those paths
+        self._vendored_changes: list[GitStatusEntry] | None = None
 
     def initialize(self, version: str, build_data: dict[str, Any]) -> None:
         """Initialize the build hook by running vendoring."""
@@ -53,49 +89,63 @@ class VendoringBuildHook(BuildHookInterface):
         if self.vendor_path and self.vendor_path.exists():
             self._check_for_uncommitted_changes()
         self._run_vendoring()
+        self._record_vendored_changes()
 
     def finalize(self, version: str, build_data: dict[str, Any], artifact_path: str) -> None:
         """Clean up vendored files after the build is complete using git."""
-        if self.vendor_path and self.vendor_path.exists():
+        # If we recorded what vendoring changed then the vendor directory exists, no need to look again
+        if self.vendor_path and (self._vendored_changes is not None or self.vendor_path.exists()):
             self.app.display_info(f"Cleaning vendored files from {self.vendor_path} using git")
             self._git_clean_vendor_dir()
 
     def _determine_vendor_path(self) -> None:
         """Determine the vendor directory path from vendoring configuration."""
+        if self.vendor_dir is not None:
+            # Already done for this build
+            return
+
         try:
-            # Use tomli for Python < 3.11, otherwise use tomllib
-            try:
-                import tomllib
-            except ImportError:
-                import tomli as tomllib
-
-            with Path(self.root, "pyproject.toml").open("rb") as f:
-                pyproject = tomllib.load(f)
-
-            self.vendor_dir = pyproject.get("tool", {}).get("vendoring", {}).get("destination")
-
-            if self.vendor_dir:
-                self.protected_files = [
-                    Path(self.vendor_dir, file).as_posix()
-                    for file in pyproject.get("tool", {}).get("vendoring", {}).get("protected-files", [])
-                ]
-                self.vendor_path = Path(self.root) / self.vendor_dir
-                self.app.display_info(f"Determined vendor directory: {self.vendor_path}")
-            else:
-                self.protected_files = []
-                self.app.display_warning("Could not determine vendor directory from vendoring config")
-                self.app.display_warning("Vendored files will not be cleaned up after build")
-        except Exception as e:
+            pyproject = _load_pyproject(str(self.root))
+        except (FileNotFoundError, ValueError) as e:  # tomllib.TOMLDecodeError is a ValueError
             self.app.display_error(f"Error determining vendor directory: {e}")
             self.app.display_warning("Vendored files will not be cleaned up after build")
+            return
+
+        vendoring_config = pyproject.get("tool", {}).get("vendoring", {})
+        self.vendor_dir = vendoring_config.get("destination")
+
+        if self.vendor_dir:
+            self.protected_files = [
+                Path(self.vendor_dir, file).as_posix() for file in vendoring_config.get("protected-files", [])
+            ]
+            self.vendor_path = Path(self.root) / self.vendor_dir
+            self.app.display_info(f"Determined vendor directory: {self.vendor_path}")
+        else:
+            self.protected_files = []
+            self.app.display_warning("Could not determine vendor directory from vendoring config")
+            self.app.display_warning("Vendored files will not be cleaned up after build")
 
     def _check_for_uncommitted_changes(self) -> None:
         """Check for uncommitted changes in vendor directory."""
-        if not self._is_git_repo():
-            self.app.display_warning("Not a git repository. Cannot check for uncommitted changes.")
+        if not self.abort_on_changed_files:
+            # We wouldn't abort, so don't pay for reading the git status just to list the changes. But cleaning up after
+            # the build removes (or reverts) them all the same, so note that. This is printed on every such build whether
+            # or not anything changed, so it is info rather than a warning, to keep warnings for real problems
+            self.app.display_info(
+                f"Note: abort-on-changed-files is false, so uncommitted changes in {self.vendor_dir} are not checked "
+                "for, and any there will be removed or reverted after the build."
+            )
             return
 
-        untracked_files, modified_files = self._get_uncommitted_changes()
+        try:
+            untracked_files, modified_files = self._get_uncommitted_changes()
+        except RuntimeError as e:
+            # A single failed `git status` covers the "not a git repository" case too, so we don't need to probe first
+            if "not a git repository" in str(e):
+                self.app.display_warning("Not a git repository. Cannot check for uncommitted changes.")
+            else:
+                self.app.display_warning(f"Could not check for uncommitted changes in vendor directory: {e}")
+            return
 
         if untracked_files or modified_files:
             message = f"Uncommitted changes detected in vendor directory: {self.vendor_dir}"
@@ -110,20 +160,19 @@ class VendoringBuildHook(BuildHookInterface):
 
             self.app.display_warning(message)
 
-            if self.abort_on_changed_files:
-                raise RuntimeError(
-                    f"Uncommitted changes in vendor directory: {self.vendor_dir}. "
-                    "Commit or stash these changes before building, or set "
-                    "abort-on-changed-files = false in plugin config to ignore."
-                )
+            raise RuntimeError(
+                f"Uncommitted changes in vendor directory: {self.vendor_dir}. "
+                "Commit or stash these changes before building, or set "
+                "abort-on-changed-files = false in plugin config to ignore."
+            )
 
     def _run_vendoring(self) -> None:
         """Run the vendoring tool to vendor dependencies."""
 
-        if not shutil.which("pip"):
+        if not _which("pip"):
             # No pip, lets see if we have `uvx` instead
 
-            if not shutil.which("uvx"):
+            if not _which("uvx"):
                 raise RuntimeError("One of `pip` and `uvx` must exist in PATH")
             import vendoring.utils
 
@@ -140,31 +189,69 @@ class VendoringBuildHook(BuildHookInterface):
         # This must happen after we have monkey patched the fns, else it won't get the right imports
         import vendoring.cli
 
-        old = Path.cwd()
-        os.chdir(self.root)
-        try:
-            ctx = vendoring.cli.main.make_context("vendoring", args=["sync"])
-            # Let this throw an exception
-            ctx.forward(vendoring.cli.sync, verbose=True)
+        # vendoring has no way to pass the project directory in -- `sync` loads the config from, and resolves the
+        # destination against, the current directory -- so we have to chdir. Hold a lock so that hooks running in
+        # other threads of this process don't race on the (process-wide) cwd
+        with _CHDIR_LOCK:
+            old = Path.cwd()
+            os.chdir(self.root)
+            try:
+                ctx = vendoring.cli.main.make_context("vendoring", args=["sync"])
+                # Let this throw an exception
+                ctx.forward(vendoring.cli.sync, verbose=True)
+                return
+            finally:
+                os.chdir(old)
+
+    def _record_vendored_changes(self) -> None:
+        """Record which paths in the vendor directory vendoring created or changed."""
+        if not self.vendor_path:
             return
-        finally:
-            os.chdir(old)
+
+        try:
+            self._vendored_changes = get_modified_and_untracked_files(self.root, self.vendor_dir, ignored=True)
+        except (OSError, RuntimeError):
+            # Not a git repository (or git failed, or isn't installed), finalize falls back to cleaning the whole
+            # vendor directory
+            self._vendored_changes = None
 
     def _git_clean_vendor_dir(self) -> None:
-        """Clean up vendor directory using git commands."""
-        if not self._is_git_repo():
+        """Clean up vendor directory using git."""
+        if self._vendored_changes is None:
+            self._git_clean_whole_vendor_dir()
+            return
+
+        untracked = filter_by_status(self._vendored_changes, FileStatus.UNTRACKED, FileStatus.IGNORED)
+        tracked = filter_by_status(
+            self._vendored_changes, FileStatus.MODIFIED, FileStatus.DELETED, FileStatus.RENAMED, FileStatus.COPIED
+        )
+        try:
+            # Delete the untracked and ignored paths vendoring created here rather than running `git clean`. git status
+            # never reports empty directories though, so those are removed separately below
+            self._remove_untracked_paths(get_filepaths(untracked))
+            # Reset any tracked files to their original state
+            checkout_files(self.root, *get_filepaths(tracked))
+            self._remove_empty_dirs()
+            self.app.display_info("Successfully cleaned vendor directory using git")
+        except (OSError, RuntimeError) as e:
+            self.app.display_error(f"Git clean failed: {e}")
+            self.app.display_warning(f"Vendored files in {self.vendor_path} may remain after build.")
+
+    def _git_clean_whole_vendor_dir(self) -> None:
+        """Clean up the vendor directory with `git clean` and `git checkout`, when we don't know what vendoring changed."""
+        if not self._is_git_repo:
             self.app.display_warning("Not a git repository. Cannot clean using git.")
             self.app.display_warning(f"Vendored files in {self.vendor_path} will remain after build.")
             return
 
         try:
             # Remove untracked files in vendor directory
-            git_clean_cmd = ["git", "clean", "-fdx", "--", str(self.vendor_dir)]
+            git_clean_cmd = [*GIT_CMD, "clean", "-fdx", "--", str(self.vendor_dir)]
             self.app.display_info(f"Running: {' '.join(git_clean_cmd)}")
             subprocess.run(git_clean_cmd, cwd=self.root, check=True, capture_output=True)
 
             # Reset any tracked files to their original state
-            git_checkout_cmd = ["git", "checkout", "--", str(self.vendor_dir)]
+            git_checkout_cmd = [*GIT_CMD, "checkout", "--", str(self.vendor_dir)]
             self.app.display_info(f"Running: {' '.join(git_checkout_cmd)}")
             subprocess.run(git_checkout_cmd, cwd=self.root, check=True, capture_output=True)
 
@@ -176,36 +263,83 @@ class VendoringBuildHook(BuildHookInterface):
             if e.stderr:
                 self.app.display_error(f"Stderr: {e.stderr.decode('utf-8')}")
             self.app.display_warning(f"Vendored files in {self.vendor_path} may remain after build.")
+        except OSError as e:
+            # There is a .git, but git itself couldn't be run (e.g. it isn't installed)
+            self.app.display_error(f"Git clean failed: {e}")
+            self.app.display_warning(f"Vendored files in {self.vendor_path} may remain after build.")
 
+    def _remove_untracked_paths(self, paths: list[str]) -> None:
+        """
+        Delete untracked files and directories, given relative to the top of the git worktree, from the vendor directory.
+
+        Raises:
+            RuntimeError: If the project is not in a git worktree, or a path is outside the vendor directory
+        """
+        if not paths:
+            return
+
+        top = get_worktree_root(self.root)
+        vendor_path = self.vendor_path.resolve()
+        self.app.display_info(f"Removing {len(paths)} untracked path(s) from {vendor_path}")
+        for path in paths:
+            target = top / path
+            if not target.is_relative_to(vendor_path):
+                raise RuntimeError(f"Refusing to delete {target}, which is outside of {vendor_path}")
+            # A single lstat tells us both whether it still exists and whether it is a real directory
+            try:
+                mode = target.lstat().st_mode
+            except FileNotFoundError:
+                continue
+            if stat.S_ISDIR(mode):
+                shutil.rmtree(target)
+            else:
+                target.unlink()
+
+    def _remove_empty_dirs(self) -> None:
+        """
+        Delete any empty directories under the vendor directory, as `git clean -d` would.
+
+        git status never reports an empty directory (git can't track one), so they aren't among the recorded changes.
+        Vendoring can still leave one behind, e.g. when a `drop` pattern empties it, and an empty directory left in the
+        vendor directory would import as a namespace package.
+        """
+        vendor_path = os.fspath(self.vendor_path)
+        # Bottom-up, so that a directory whose subdirectories were all empty is itself empty by the time we reach it
+        for dirpath, _, filenames in os.walk(vendor_path, topdown=False):
+            if filenames or dirpath == vendor_path:
+                continue
+            # Not empty after all if it still has a subdirectory (or a symlink to one) in it
+            with suppress(OSError):
+                Path(dirpath).rmdir()
+
+    @cached_property
     def _is_git_repo(self) -> bool:
-        """Check if the project is a git repository."""
+        """Whether the project is in a git worktree. This is only worked out once, as `self.root` doesn't change."""
         try:
-            subprocess.run(
-                ["git", "rev-parse", "--is-inside-work-tree"],
-                cwd=self.root,
-                check=True,
-                capture_output=True,
-            )
-            return True
-        except (subprocess.SubprocessError, FileNotFoundError):
+            get_worktree_root(self.root)
+        except RuntimeError:
             return False
+        return True
 
     def _get_uncommitted_changes(self) -> tuple[list[str], list[str]]:
-        """Get lists of untracked and modified files in vendor directory."""
-        untracked_files = []
-        modified_files = []
+        """
+        Get lists of untracked and modified files in vendor directory.
 
+        Raises:
+            RuntimeError: If git status fails, e.g. because the project is not a git repository
+        """
         if not self.vendor_dir:
-            return untracked_files, modified_files
-
-        try:
-            files = get_modified_and_untracked_files(self.vendor_path)
-            modified_files = get_filepaths(filter_by_status(files, FileStatus.MODIFIED))
-            untracked_files = get_filepaths(filter_by_status(files, FileStatus.UNTRACKED))
-
-            modified_files = [file for file in modified_files if file not in self.protected_files]
-            untracked_files = [file for file in untracked_files if file not in self.protected_files]
-        except RuntimeError:
-            self.app.display_warning("Could not check for uncommitted changes in vendor directory")
+            return [], []
+
+        # List every untracked file rather than just its directory, so that protected files in a new directory are
+        # matched and the warning names each offending file
+        files = get_modified_and_untracked_files(self.root, self.vendor_dir, untracked_files="all")
+        files = [entry for entry in files if entry.filepath not in self.protected_files]
+
+        untracked_files = get_filepaths(filter_by_status(files, FileStatus.UNTRACKED))
+        # Anything else git reports has changed in the worktree (modified, deleted, renamed, copied)
+        modified_files = get_filepaths(
+            filter_by_status(files, FileStatus.MODIFIED, FileStatus.DELETED, FileStatus.RENAMED, FileStatus.COPIED)
+        )
 
         return untracked_files, modified_files
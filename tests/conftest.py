@@ -1,10 +1,13 @@
 import shutil
 import subprocess
 import sys
+import venv
 from pathlib import Path
 
 import pytest
 
+from .utils import build_project
+
 
 def pytest_addoption(parser: pytest.Parser):
     """Add options parser for custom plugins."""
@@ -26,24 +29,71 @@ def plugin_uri(tmp_path_factory, request):
     return directory.resolve().as_uri()
 
 
+@pytest.fixture(scope="session")
+def build_python(tmp_path_factory, plugin_uri):
+    """
+    The python of a virtualenv with everything needed to build the test project installed.
+
+    Builds run without isolation in this, so that the build requirements are installed once for the session rather
+    than into a fresh environment for every build.
+    """
+    directory = tmp_path_factory.mktemp("build-env")
+    venv.create(directory, with_pip=True)
+    python = directory / ("Scripts" if sys.platform == "win32" else "bin") / "python"
+    subprocess.run(
+        [python, "-m", "pip", "install", "--quiet", "build", "hatchling", f"hatch-build-time-vendoring @ {plugin_uri}"],
+        check=True,
+    )
+    return python
+
+
+@pytest.fixture(scope="session")
+def project_template(tmp_path_factory, plugin_uri):
+    """The test project committed to a git repository, made once per session for `project_dir` to copy."""
+    tmpdir = tmp_path_factory.mktemp("my-app-template")
+    create_project(tmpdir, plugin_uri)
+    return tmpdir
+
+
 @pytest.fixture
-def project_dir(tmp_path_factory, plugin_uri, monkeypatch):
+def project_dir(tmp_path_factory, project_template, monkeypatch):
     """Create a temporary project directory for testing."""
 
     tmpdir = tmp_path_factory.mktemp("my-app")
+    shutil.copytree(project_template, tmpdir, symlinks=True, dirs_exist_ok=True)
     monkeypatch.chdir(tmpdir)
 
-    # Create project structure
-    create_project_structure(tmpdir, plugin_uri)
+    yield tmpdir
+
 
-    # Initialize git repository
-    subprocess.run(["git", "init"], check=True, capture_output=True)
-    subprocess.run(["git", "config", "user.name", "Test User"], check=True, capture_output=True)
-    subprocess.run(["git", "config", "user.email", "test@example.com"], check=True, capture_output=True)
-    subprocess.run(["git", "add", "."], check=True, capture_output=True)
-    subprocess.run(["git", "commit", "-m", "Initial commit"], check=True, capture_output=True)
+@pytest.fixture(scope="session")
+def built_project_dir(tmp_path_factory, project_template, build_python):
+    """
+    A project that has been built once for the whole session.
 
-    yield tmpdir
+    Tests that only inspect the result of an unmodified build share this rather than each paying for their own build.
+    They must not change it. Under pytest-xdist each worker has its own, as session fixtures are per worker.
+    """
+    tmpdir = tmp_path_factory.mktemp("my-app-built")
+    shutil.copytree(project_template, tmpdir, symlinks=True, dirs_exist_ok=True)
+    build_project(python=build_python, cwd=tmpdir)
+
+    return tmpdir
+
+
+def create_project(project_dir, plugin_uri):
+    """Create the test project, and commit it to a new git repository."""
+    create_project_structure(project_dir, plugin_uri)
+
+    # Initialize git repository
+    for args in (
+        ["git", "init"],
+        ["git", "config", "user.name", "Test User"],
+        ["git", "config", "user.email", "test@example.com"],
+        ["git", "add", "."],
+        ["git", "commit", "-m", "Initial commit"],
+    ):
+        subprocess.run(args, cwd=project_dir, check=True, capture_output=True)
 
 
 def create_project_structure(project_dir, plugin_uri):
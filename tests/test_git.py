@@ -1,12 +1,19 @@
+import contextlib
+import io
 import subprocess
-from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
+from unittest.mock import ANY, patch
 
 import pytest
 
 from hatch_build_time_vendoring.git import (
+    GIT_CMD,
     FileStatus,
     GitStatusEntry,
+    _split_records,
+    checkout_files,
     get_modified_and_untracked_files,
+    get_worktree_root,
     parse_git_status_porcelain,
 )
 
@@ -27,28 +34,65 @@ def sample_entries():
     ]
 
 
+@pytest.fixture
+def status_repo(tmp_path):
+    """A real git repository with a mix of modified, deleted, staged and untracked files."""
+    subprocess.run(["git", "init", "-q"], cwd=tmp_path, check=True)
+    for name in ("modified.py", "deleted.py", "vendor/tracked.py"):
+        tmp_path.joinpath(name).parent.mkdir(exist_ok=True)
+        tmp_path.joinpath(name).write_text("original\n")
+    subprocess.run(["git", "add", "."], cwd=tmp_path, check=True)
+    subprocess.run(
+        ["git", "-c", "user.name=Test User", "-c", "user.email=test@example.com", "commit", "-q", "-m", "Initial commit"],
+        cwd=tmp_path,
+        check=True,
+    )
+
+    tmp_path.joinpath("modified.py").write_text("changed\n")
+    tmp_path.joinpath("deleted.py").unlink()
+    tmp_path.joinpath("staged.py").write_text("staged\n")
+    subprocess.run(["git", "add", "staged.py"], cwd=tmp_path, check=True)
+    tmp_path.joinpath("untracked.py").write_text("untracked\n")
+    tmp_path.joinpath('caf\u00e9 "quoted".py').write_text("untracked\n")
+    tmp_path.joinpath("vendor/tracked.py").write_text("changed\n")
+    tmp_path.joinpath("vendor/new").mkdir()
+    tmp_path.joinpath("vendor/new/untracked.py").write_text("untracked\n")
+    tmp_path.joinpath(".git/info/exclude").write_text("*.pyc\n")
+    tmp_path.joinpath("vendor/ignored.pyc").write_text("ignored\n")
+    return tmp_path
+
+
+def fake_popen(stdout=b"", stderr=b"", returncode=0):
+    """Build a stand-in for subprocess.Popen that "runs" a command with the given output."""
+
+    def popen(args, **kwargs):
+        kwargs["stderr"].write(stderr)
+        # Only stdout and returncode are read, which doesn't need a MagicMock
+        return contextlib.nullcontext(SimpleNamespace(stdout=io.BytesIO(stdout), returncode=returncode))
+
+    return popen
+
+
 @pytest.fixture
 def mock_successful_git_run():
     """Mock successful git command execution."""
-    with patch("hatch_build_time_vendoring.git.subprocess.run", autospec=True) as mock_run:
-        mock_result = MagicMock()
-        mock_result.stdout = "?? test.py\n M another.py"
-        mock_run.return_value = mock_result
-        yield mock_run
+    with patch("hatch_build_time_vendoring.git.subprocess.Popen") as mock_popen:
+        mock_popen.side_effect = fake_popen(stdout=b"?? test.py\0 M another.py\0")
+        yield mock_popen
 
 
 @pytest.fixture
 def mock_failed_git_run():
     """Mock failed git command execution."""
-    with patch("hatch_build_time_vendoring.git.subprocess.run", autospec=True) as mock_run:
-        mock_run.side_effect = subprocess.CalledProcessError(1, ["git", "status"], stderr="Not a git repository")
-        yield mock_run
+    with patch("hatch_build_time_vendoring.git.subprocess.Popen") as mock_popen:
+        mock_popen.side_effect = fake_popen(stderr=b"Not a git repository", returncode=128)
+        yield mock_popen
 
 
 # Test functions for parsing git status porcelain output
 def test_parse_empty_output():
     """Test parsing empty git status output returns empty list."""
-    output = ""
+    output = b""
 
     result = parse_git_status_porcelain(output)
 
@@ -58,18 +102,24 @@ def test_parse_empty_output():
 @pytest.mark.parametrize(
     ("output", "expected"),
     (
-        pytest.param("?? file.py", [GitStatusEntry(FileStatus.UNTRACKED, "file.py")], id="untracked"),
-        pytest.param(" M file.py", [GitStatusEntry(FileStatus.MODIFIED, "file.py")], id="modified"),
-        pytest.param(" D file.py", [GitStatusEntry(FileStatus.DELETED, "file.py")], id="deleted"),
-        pytest.param("A file.py", [], id="fully-staged"),
-        pytest.param("M file.py", [], id="staged-modified"),
-        pytest.param("MM file.py", [GitStatusEntry(FileStatus.MODIFIED, "file.py")], id="staged-and-modified"),
-        pytest.param("AM file.py", [GitStatusEntry(FileStatus.MODIFIED, "file.py")], id="added-and-modified"),
-        pytest.param("R  old.py -> file.py", [], id="renamed-and-staged"),
+        pytest.param(b"?? file.py\0", [GitStatusEntry(FileStatus.UNTRACKED, "file.py")], id="untracked"),
+        pytest.param(b" M file.py\0", [GitStatusEntry(FileStatus.MODIFIED, "file.py")], id="modified"),
+        pytest.param(b" D file.py\0", [GitStatusEntry(FileStatus.DELETED, "file.py")], id="deleted"),
+        pytest.param(b"A  file.py\0", [], id="fully-staged"),
+        pytest.param(b"M  file.py\0", [], id="staged-modified"),
+        pytest.param(b"MM file.py\0", [GitStatusEntry(FileStatus.MODIFIED, "file.py")], id="staged-and-modified"),
+        pytest.param(b"AM file.py\0", [GitStatusEntry(FileStatus.MODIFIED, "file.py")], id="added-and-modified"),
+        pytest.param(b"R  file.py\0old.py\0", [], id="renamed-and-staged"),
+        pytest.param(
+            b"RM file.py\0old.py\0", [GitStatusEntry(FileStatus.MODIFIED, "file.py", "old.py")], id="renamed-and-modified"
+        ),
+        pytest.param(b"UU old.py\0", [], id="conflicted"),
+        pytest.param(b"!! build/\0", [GitStatusEntry(FileStatus.IGNORED, "build/")], id="ignored"),
         pytest.param(
-            "RM old.py -> file.py", [GitStatusEntry(FileStatus.MODIFIED, "file.py", "old.py")], id="renamed-and-modified"
+            b"R  staged.py\0old.py\0 M file.py\0",
+            [GitStatusEntry(FileStatus.MODIFIED, "file.py")],
+            id="skipped-rename-consumes-original",
         ),
-        pytest.param("UU old.py", [], id="conflicted"),
     ),
 )
 def test_parse_untracked_file(output, expected):
@@ -78,14 +128,41 @@ def test_parse_untracked_file(output, expected):
     assert result == expected
 
 
+@pytest.mark.parametrize(
+    ("record", "expected"),
+    (
+        pytest.param(b"?? file with spaces.py\0", "file with spaces.py", id="spaces"),
+        pytest.param(b"?? tab\tand\nnewline.py\0", "tab\tand\nnewline.py", id="control-chars"),
+        pytest.param(b'?? quote"and\\backslash.py\0', 'quote"and\\backslash.py', id="quote-and-backslash"),
+        pytest.param(b"?? a -> b.py\0", "a -> b.py", id="arrow"),
+        pytest.param(b"?? caf\xc3\xa9.py\0", "caf\u00e9.py", id="utf8"),
+        pytest.param(b"?? latin1-caf\xe9.py\0", "latin1-caf\udce9.py", id="not-utf8"),
+    ),
+)
+def test_parse_special_filepaths(record, expected):
+    """Test that filepaths with special characters are taken as-is, since -z output isn't quoted."""
+    assert parse_git_status_porcelain(record) == [GitStatusEntry(FileStatus.UNTRACKED, expected)]
+
+
+def test_split_records_across_reads():
+    """Test that records split across reads from the stream are joined back together."""
+
+    class ChunkedStream:
+        def __init__(self, *chunks):
+            self.chunks = list(chunks)
+
+        def read1(self):
+            return self.chunks.pop(0) if self.chunks else b""
+
+    stream = ChunkedStream(b"?? fi", b"le.py\0 M a", b"\0RM new.py\0o", b"ld.py\0")
+
+    assert list(_split_records(stream)) == [b"?? file.py", b" M a", b"RM new.py", b"old.py"]
+
+
 def test_parse_multiple_files():
     """Test parsing multiple files with different statuses ignores staged-only files."""
     # Arrange
-    output = """?? untracked.py
- M modified.py
- D deleted.py
-A  staged.py
-MM staged_and_modified.py"""
+    output = b"?? untracked.py\0 M modified.py\0 D deleted.py\0A  staged.py\0MM staged_and_modified.py\0"
 
     # Act
     result = parse_git_status_porcelain(output)
@@ -109,9 +186,7 @@ MM staged_and_modified.py"""
 def test_parse_mixed_index_worktree_statuses():
     """Test parsing files with different index and worktree statuses."""
     # Arrange
-    output = """AM added_and_modified.py
-RM renamed_and_modified.py -> new_name.py
-CM copied_and_modified.py -> copy_name.py"""
+    output = b"AM added_and_modified.py\0RM new_name.py\0renamed_and_modified.py\0CM copy_name.py\0copied_and_modified.py\0"
 
     # Act
     result = parse_git_status_porcelain(output)
@@ -132,34 +207,97 @@ def test_successful_git_command(mock_successful_git_run):
 
     # Assert
     mock_successful_git_run.assert_called_once_with(
-        ["git", "status", "--porcelain=v1", "."], cwd=".", capture_output=True, text=True, check=True
+        [*GIT_CMD, "status", "--porcelain=v1", "-z", "--untracked-files=normal", "--"],
+        cwd=".",
+        stdout=subprocess.PIPE,
+        stderr=ANY,
     )
 
-    assert len(result) == 2
-    assert result[0].status == FileStatus.UNTRACKED
-    assert result[1].status == FileStatus.MODIFIED
+    assert result == [GitStatusEntry(FileStatus.UNTRACKED, "test.py"), GitStatusEntry(FileStatus.MODIFIED, "another.py")]
 
 
 def test_git_command_failure(mock_failed_git_run):
     """Test git command failure raises RuntimeError with appropriate message."""
     # Act & Assert
-    with pytest.raises(RuntimeError, match="Git command failed") as exc_info:
+    with pytest.raises(RuntimeError, match="Git command failed: Not a git repository") as exc_info:
         get_modified_and_untracked_files()
     assert isinstance(exc_info.value.__cause__, subprocess.CalledProcessError)
 
 
+def test_git_not_installed(status_repo, monkeypatch):
+    """Test that git not being installed raises RuntimeError like any other git failure."""
+    monkeypatch.setenv("PATH", "/nonexistent")
+
+    with pytest.raises(RuntimeError, match="Git command failed") as exc_info:
+        get_modified_and_untracked_files(status_repo)
+    assert isinstance(exc_info.value.__cause__, FileNotFoundError)
+
+
+def test_git_status_real_repo(status_repo):
+    """Test running and parsing `git status` against a real repository."""
+    result = get_modified_and_untracked_files(status_repo)
+
+    assert sorted(result, key=lambda e: e.filepath) == [
+        GitStatusEntry(FileStatus.UNTRACKED, 'caf\u00e9 "quoted".py'),
+        GitStatusEntry(FileStatus.DELETED, "deleted.py"),
+        GitStatusEntry(FileStatus.MODIFIED, "modified.py"),
+        GitStatusEntry(FileStatus.UNTRACKED, "untracked.py"),
+        GitStatusEntry(FileStatus.UNTRACKED, "vendor/new/"),
+        GitStatusEntry(FileStatus.MODIFIED, "vendor/tracked.py"),
+    ]
+
+
+def test_git_status_pathspec_narrows_output(status_repo):
+    """Test that git itself leaves out files outside of the pathspecs, rather than us filtering its output."""
+    records = []
+
+    def recording_split_records(stream):
+        for record in _split_records(stream):
+            records.append(record)
+            yield record
+
+    with patch("hatch_build_time_vendoring.git._split_records", recording_split_records):
+        get_modified_and_untracked_files(status_repo, "vendor")
+
+    assert sorted(records) == [b" M vendor/tracked.py", b"?? vendor/new/"]
+
+
+def test_git_status_pathspec_in_untracked_directory(status_repo):
+    """Test that a pathspec inside a wholly untracked directory is reported itself, not as that directory."""
+    vendor_dir = status_repo / "proj" / "src" / "a" / "_vendor"
+    vendor_dir.mkdir(parents=True)
+    vendor_dir.joinpath("urllib3").mkdir()
+    vendor_dir.joinpath("urllib3", "__init__.py").write_text("# vendored\n")
+
+    result = get_modified_and_untracked_files(status_repo / "proj", "src/a/_vendor", ignored=True)
+
+    assert result == [GitStatusEntry(FileStatus.UNTRACKED, "proj/src/a/_vendor/")]
+
+
+def test_git_status_untracked_files_all(status_repo):
+    """Test that untracked_files="all" lists the files inside an untracked directory, not the directory itself."""
+    result = get_modified_and_untracked_files(status_repo, "vendor", untracked_files="all")
+
+    assert sorted(result, key=lambda e: e.filepath) == [
+        GitStatusEntry(FileStatus.UNTRACKED, "vendor/new/untracked.py"),
+        GitStatusEntry(FileStatus.MODIFIED, "vendor/tracked.py"),
+    ]
+
+
 def test_integration_with_real_git_status_format():
-    """Test integration with realistic git status --porcelain=v1 output."""
+    """Test integration with realistic git status --porcelain=v1 -z output."""
     # Arrange
-    output = """?? .gitignore
- M README.md
- D old_file.txt
-A  new_staged_file.py
-MM src/main.py
-R  old_name.py -> src/new_name.py
-C  template.py -> src/copy.py
- M "file with spaces.txt"
-?? "another spaced file.py" """
+    output = (
+        b"?? .gitignore\0"
+        b" M README.md\0"
+        b" D old_file.txt\0"
+        b"A  new_staged_file.py\0"
+        b"MM src/main.py\0"
+        b"R  src/new_name.py\0old_name.py\0"
+        b"C  src/copy.py\0template.py\0"
+        b" M file with spaces.txt\0"
+        b"?? another spaced file.py\0"
+    )
 
     # Act
     all_entries = parse_git_status_porcelain(output)
@@ -178,3 +316,34 @@ C  template.py -> src/copy.py
     assert "file with spaces.txt" in filepaths
     assert "another spaced file.py" in filepaths
     assert "new_staged_file.py" not in filepaths
+
+
+def test_get_worktree_root(status_repo):
+    """Test finding the top of the worktree from a subdirectory."""
+    assert get_worktree_root(status_repo / "vendor") == status_repo.resolve()
+
+
+def test_get_worktree_root_not_a_git_repo(tmp_path):
+    """Test that a directory outside of any git worktree raises RuntimeError."""
+    with pytest.raises(RuntimeError, match="not in a git worktree"):
+        get_worktree_root(tmp_path)
+
+
+def test_checkout_files(status_repo):
+    """Test restoring files from the index, given relative to the top of the worktree."""
+    checkout_files(status_repo / "vendor", "vendor/tracked.py", "deleted.py")
+
+    assert (status_repo / "vendor/tracked.py").read_text() == "original\n"
+    assert (status_repo / "deleted.py").read_text() == "original\n"
+    # Anything we didn't ask for is left alone, including what is staged
+    assert (status_repo / "modified.py").read_text() == "changed\n"
+    staged = subprocess.run(["git", "diff", "--cached", "--name-only"], cwd=status_repo, check=True, capture_output=True)
+    assert staged.stdout == b"staged.py\n"
+
+
+def test_checkout_files_git_not_installed(status_repo, monkeypatch):
+    """Test that git not being installed raises RuntimeError like any other git failure."""
+    monkeypatch.setenv("PATH", "/nonexistent")
+
+    with pytest.raises(RuntimeError, match="Git command failed"):
+        checkout_files(status_repo, "vendor/tracked.py")
@@ -4,12 +4,15 @@ Integration tests for hatch-build-time-vendoring plugin using actual Hatch build
 
 import shutil
 import subprocess
+import zipfile
 from pathlib import Path
 
 import pytest
 
 from .utils import build_project
 
+HAS_GIT = shutil.which("git") is not None
+
 
 def get_plugin_path():
     """Get the path to the plugin directory."""
@@ -17,58 +20,51 @@ def get_plugin_path():
     return str(Path(__file__).parent.parent.absolute())
 
 
-def test_build_with_vendoring(project_dir: Path):
+def test_build_with_vendoring(built_project_dir: Path):
     """
     Test building a package with the vendoring plugin.
 
-    This test:
-    1. Sets up a test package that uses hatch-build-time-vendoring
-    2. Runs hatch build
-    3. Checks that vendored files are in the wheel but not in source
+    The `built_project_dir` fixture sets up a test package that uses hatch-build-time-vendoring and builds it. This
+    checks that both distributions were created.
     """
-    build_project()
-
     # Check that dist directory was created and contains files
-    dist_dir = project_dir / "dist"
+    dist_dir = built_project_dir / "dist"
     assert dist_dir.exists(), "dist directory not created"
 
-    wheel_files = list(dist_dir.glob("*.whl"))
-    sdist_files = list(dist_dir.glob("*.tar.gz"))
+    assert list(dist_dir.glob("*.whl")), "No wheel file was created"
+    assert list(dist_dir.glob("*.tar.gz")), "No sdist file was created"
 
-    assert wheel_files, "No wheel file was created"
-    assert sdist_files, "No sdist file was created"
 
-    # Verify the vendor directory exists in the wheel
-    import zipfile
+def test_build_wheel_contains_vendored_files(built_project_dir: Path):
+    """Test that the vendored files are in the built wheel."""
+    (wheel_file,) = (built_project_dir / "dist").glob("*.whl")
 
-    with zipfile.ZipFile(wheel_files[0]) as wheel:
-        wheel_files_list = wheel.namelist()
-        # Look for vendored files (any file in the _vendor directory)
-        vendor_files = [f for f in wheel_files_list if "/_vendor/" in f]
-        assert vendor_files, "No vendored files found in wheel"
+    # Verify the vendored package is in the wheel, looking it up directly rather than scanning every entry
+    with zipfile.ZipFile(wheel_file) as wheel:
+        vendor_dir = zipfile.Path(wheel, "my_app/_vendor/")
+        assert vendor_dir.exists(), "No vendored files found in wheel"
+        assert (vendor_dir / "urllib3" / "__init__.py").exists(), "urllib3 not found in wheel"
 
-        # Check specifically for urllib3
-        urllib3_files = [f for f in wheel_files_list if "urllib3" in f]
-        assert urllib3_files, "urllib3 not found in wheel"
 
+def test_build_cleans_up_vendored_files(built_project_dir: Path):
+    """Test that the vendored files are removed from the source tree after the build."""
     # Verify the vendor directory was cleaned up from source
-    vendor_dir = project_dir / "src" / "my_app" / "_vendor"
+    vendor_dir = built_project_dir / "src" / "my_app" / "_vendor"
     children = [f.name for f in vendor_dir.glob("*")]
     assert children == [".gitignore"]
 
     # Verify git status is clean
     git_status = subprocess.run(
         ["git", "status", "--porcelain", "src"],
-        cwd=project_dir,
+        cwd=built_project_dir,
         capture_output=True,
-        text=True,
         check=True,
     )
     assert not git_status.stdout.strip(), "Git working directory not clean after build"
 
 
-@pytest.mark.skipif(shutil.which("git") is None, reason="Git not available")
-def test_build_with_unstaged_changes(project_dir):
+@pytest.mark.skipif(not HAS_GIT, reason="Git not available")
+def test_build_with_unstaged_changes(project_dir, build_python):
     """
     Test that build fails when there are uncommitted changes in vendor directory.
     """
@@ -78,13 +74,13 @@ def test_build_with_unstaged_changes(project_dir):
 
     # Build should fail due to uncommitted changes
     with pytest.raises(Exception, match="Uncommitted changes") as cx:
-        build_project()
+        build_project(python=build_python, cwd=project_dir)
 
     cx.match(r"- src/my_app/_vendor/test_file.py\n")
 
 
-@pytest.mark.skipif(shutil.which("git") is None, reason="Git not available")
-def test_build_ok_with_protected_changes(project_dir):
+@pytest.mark.skipif(not HAS_GIT, reason="Git not available")
+def test_build_ok_with_protected_changes(project_dir, build_python):
     """
     Test that build fails when there are uncommitted changes in vendor directory.
     """
@@ -93,11 +89,11 @@ def test_build_ok_with_protected_changes(project_dir):
     (vendor_dir / "__init__.py").write_text("# Test file\n")
 
     # Build not should fail
-    build_project()
+    build_project(python=build_python, cwd=project_dir)
 
 
-@pytest.mark.skipif(shutil.which("git") is None, reason="Git not available")
-def test_build_with_uncommitted_changes(project_dir):
+@pytest.mark.skipif(not HAS_GIT, reason="Git not available")
+def test_build_with_uncommitted_changes(project_dir, build_python):
     """
     Test that build fails when there are uncommitted changes in vendor directory.
     """
@@ -107,11 +103,11 @@ def test_build_with_uncommitted_changes(project_dir):
 
     # Build should fail due to uncommitted changes
     with pytest.raises(Exception, match="Uncommitted changes"):
-        build_project()
+        build_project(python=build_python, cwd=project_dir)
 
 
-@pytest.mark.skipif(shutil.which("git") is None, reason="Git not available")
-def test_build_with_allow_uncommitted_changes(project_dir):
+@pytest.mark.skipif(not HAS_GIT, reason="Git not available")
+def test_build_with_allow_uncommitted_changes(project_dir, build_python):
     """
     Test that build succeeds with uncommitted changes when abort-on-changed-files is false.
     """
@@ -134,7 +130,7 @@ def test_build_with_allow_uncommitted_changes(project_dir):
     (vendor_dir / "test_file.py").write_text("# Test file\n")
 
     # Run hatch build - should succeed despite uncommitted changes
-    build_project()
+    build_project(python=build_python, cwd=project_dir)
 
     # Check that dist directory was created and contains files
     dist_dir = project_dir / "dist"
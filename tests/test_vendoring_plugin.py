@@ -4,11 +4,12 @@ Tests for the hatch-build-time-vendoring plugin.
 
 import subprocess
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from unittest.mock import PropertyMock, patch
 
 import pytest
 
-from hatch_build_time_vendoring.plugin import VendoringBuildHook
+from hatch_build_time_vendoring.git import GIT_CMD, FileStatus, GitStatusEntry
+from hatch_build_time_vendoring.plugin import VendoringBuildHook, _load_pyproject
 
 
 @pytest.fixture
@@ -78,21 +79,55 @@ class TestVendoringBuildHook:
         assert hook.vendor_dir is None
         assert hook.vendor_path is None
 
-    @patch("subprocess.run")
-    def test_is_git_repo_true(self, mock_run, hook):
-        """Test checking if directory is a git repo when it is."""
-        mock_run.return_value = MagicMock(returncode=0)
+    @pytest.mark.parametrize("content", (None, "[tool.vendoring\n"), ids=("missing", "malformed"))
+    def test_determine_vendor_path_bad_pyproject(self, project_dir, hook, content):
+        """Test that a missing or unparseable pyproject.toml is reported rather than raised."""
+        pyproject = project_dir / "pyproject.toml"
+        if content is None:
+            pyproject.unlink()
+        else:
+            pyproject.write_text(content)
 
-        assert hook._is_git_repo() is True
-        mock_run.assert_called_once()
+        hook._determine_vendor_path()
 
-    @patch("subprocess.run")
-    def test_is_git_repo_false(self, mock_run, hook):
+        assert hook.vendor_path is None
+
+    def test_determine_vendor_path_parses_pyproject_once(self, mock_toml_load, project_dir):
+        """Test that hooks for several targets of the same project share one parse of pyproject.toml."""
+        mock_toml_load.return_value = {"tool": {"vendoring": {"destination": "src/my_app/_vendor"}}}
+
+        for target in ("sdist", "wheel"):
+            hook = VendoringBuildHook(project_dir, {}, {}, {}, None, target)
+            hook._determine_vendor_path()
+            assert hook.vendor_dir == "src/my_app/_vendor"
+
+        mock_toml_load.assert_called_once()
+
+    @patch("hatch_build_time_vendoring.plugin._load_pyproject", wraps=_load_pyproject)
+    def test_determine_vendor_path_cached(self, mock_load_pyproject, hook, vendor_path):
+        """Test that determining the vendor path again for the same build is a no-op."""
+        hook._determine_vendor_path()
+        hook._determine_vendor_path()
+
+        assert hook.vendor_path == vendor_path
+        mock_load_pyproject.assert_called_once()
+
+    def test_is_git_repo_true(self, hook):
+        """Test checking if directory is a git repo when it is."""
+        assert hook._is_git_repo is True
+
+    def test_is_git_repo_false(self, tmp_path):
         """Test checking if directory is a git repo when it isn't."""
-        mock_run.side_effect = subprocess.SubprocessError()
+        hook = VendoringBuildHook(str(tmp_path), {}, {}, {}, None, "sdist")
 
-        assert hook._is_git_repo() is False
-        mock_run.assert_called_once()
+        assert hook._is_git_repo is False
+
+    @patch("hatch_build_time_vendoring.plugin.get_worktree_root")
+    def test_is_git_repo_cached(self, mock_get_worktree_root, hook):
+        """Test that the git repo probe only runs once per hook."""
+        assert hook._is_git_repo is True
+        assert hook._is_git_repo is True
+        mock_get_worktree_root.assert_called_once()
 
     @pytest.mark.parametrize(
         ("path", "content", "expected"),
@@ -106,6 +141,12 @@ class TestVendoringBuildHook:
                 (["src/my_app/_vendor/foo.py"], []),
                 id="untracked",
             ),
+            pytest.param(
+                "src/my_app/_vendor/new/foo.py",
+                "Untracked content",
+                (["src/my_app/_vendor/new/foo.py"], []),
+                id="untracked-in-new-directory",
+            ),
         ),
     )
     def test_get_uncommitted_changes(self, project_dir, hook, path, content, expected):
@@ -114,24 +155,79 @@ class TestVendoringBuildHook:
 
         if content is not None:
             untracked_file = project_dir / path
+            untracked_file.parent.mkdir(exist_ok=True)
             untracked_file.write_text(content)
 
         # There should now be uncommitted changes
         assert hook._get_uncommitted_changes() == expected
 
-    def test_get_uncommitted_changes_staged_changes(self, hook, vendor_path):
+    def test_get_uncommitted_changes_staged_changes(self, project_dir, hook, vendor_path):
         """Test that get_uncommitted_changes correctly allowed staged changes."""
         hook._determine_vendor_path()
 
         untracked_file = vendor_path / "foo.txt"
         untracked_file.write_text("hello")
-        subprocess.run(["git", "add", "."], check=True, capture_output=True)
+        subprocess.run(["git", "add", "--", untracked_file], cwd=project_dir, check=True, capture_output=True)
 
         assert hook._get_uncommitted_changes() == ([], [])
 
+    def test_get_uncommitted_changes_deleted(self, project_dir, hook, vendor_path):
+        """Test that deleting a tracked vendored file counts as a modification."""
+        hook._determine_vendor_path()
+
+        (vendor_path / ".gitignore").unlink()
+
+        assert hook._get_uncommitted_changes() == ([], ["src/my_app/_vendor/.gitignore"])
+
+    @pytest.mark.parametrize(
+        ("error", "warning"),
+        (
+            pytest.param(
+                "Git command failed: fatal: not a git repository (or any of the parent directories): .git",
+                "Not a git repository. Cannot check for uncommitted changes.",
+                id="not-a-git-repo",
+            ),
+            pytest.param(
+                "Git command failed: fatal: unable to read tree",
+                "Could not check for uncommitted changes in vendor directory: Git command failed: fatal: unable to read tree",
+                id="other-failure",
+            ),
+        ),
+    )
+    @patch.object(VendoringBuildHook, "app", new_callable=PropertyMock)
+    @patch.object(VendoringBuildHook, "_is_git_repo", new_callable=PropertyMock)
+    @patch("hatch_build_time_vendoring.plugin.get_modified_and_untracked_files")
+    def test_check_for_uncommitted_changes_git_fails(self, mock_get_files, mock_is_git_repo, mock_app, hook, error, warning):
+        """Test that a failing git status is reported, telling "not a git repo" apart without a separate probe."""
+        hook._determine_vendor_path()
+        mock_get_files.side_effect = RuntimeError(error)
+
+        # Should not raise, just warn
+        hook._check_for_uncommitted_changes()
+
+        mock_get_files.assert_called_once()
+        mock_is_git_repo.assert_not_called()
+        mock_app.return_value.display_warning.assert_called_once_with(warning)
+
+    def test_check_for_uncommitted_changes_git_not_installed(self, hook, monkeypatch):
+        """Test that the build carries on, with a warning, when git isn't installed."""
+        hook._determine_vendor_path()
+        monkeypatch.setenv("PATH", "/nonexistent")
+
+        # Should not raise, just warn
+        hook._check_for_uncommitted_changes()
+
+    def test_check_for_uncommitted_changes_aborts(self, hook, vendor_path):
+        """Test that uncommitted changes abort the build by default."""
+        hook._determine_vendor_path()
+        (vendor_path / "foo.py").write_text("Untracked content")
+
+        with pytest.raises(RuntimeError, match="Uncommitted changes in vendor directory"):
+            hook._check_for_uncommitted_changes()
+
     @patch("subprocess.run")
     @patch("pathlib.Path.exists")
-    @patch.object(VendoringBuildHook, "_is_git_repo")
+    @patch.object(VendoringBuildHook, "_is_git_repo", new_callable=PropertyMock)
     def test_git_clean_vendor_dir(self, mock_is_git_repo, mock_exists, mock_run, hook, vendor_path):
         """Test git cleaning the vendor directory."""
         hook.vendor_dir = "src/my_app/_vendor"
@@ -143,15 +239,166 @@ class TestVendoringBuildHook:
         assert mock_run.call_count == 2
         # Check first call (git clean)
         clean_call = mock_run.call_args_list[0]
-        assert clean_call[0][0][0:3] == ["git", "clean", "-fdx"]
+        assert clean_call[0][0][0:4] == [*GIT_CMD, "clean", "-fdx"]
         assert clean_call[0][0][-1] == "src/my_app/_vendor"
 
         # Check second call (git checkout)
         checkout_call = mock_run.call_args_list[1]
-        assert checkout_call[0][0][0:3] == ["git", "checkout", "--"]
+        assert checkout_call[0][0][0:4] == [*GIT_CMD, "checkout", "--"]
         assert checkout_call[0][0][-1] == "src/my_app/_vendor"
 
-    @patch.object(VendoringBuildHook, "_is_git_repo")
+    @patch("subprocess.run")
+    @patch("hatch_build_time_vendoring.plugin.checkout_files")
+    @patch.object(VendoringBuildHook, "_remove_untracked_paths")
+    @patch.object(VendoringBuildHook, "_is_git_repo", new_callable=PropertyMock)
+    def test_git_clean_vendored_changes_only(
+        self, mock_is_git_repo, mock_remove, mock_checkout, mock_run, hook, project_dir, vendor_path
+    ):
+        """Test that only the paths vendoring changed are cleaned when we know what they are."""
+        hook.vendor_dir = "src/my_app/_vendor"
+        hook.vendor_path = vendor_path
+        hook._vendored_changes = [
+            GitStatusEntry(FileStatus.UNTRACKED, "src/my_app/_vendor/urllib3/"),
+            GitStatusEntry(FileStatus.IGNORED, "src/my_app/_vendor/vendor.txt"),
+            GitStatusEntry(FileStatus.MODIFIED, "src/my_app/_vendor/__init__.py"),
+        ]
+
+        hook._git_clean_vendor_dir()
+
+        mock_is_git_repo.assert_not_called()
+        mock_remove.assert_called_once_with(["src/my_app/_vendor/urllib3/", "src/my_app/_vendor/vendor.txt"])
+        mock_checkout.assert_called_once_with(project_dir, "src/my_app/_vendor/__init__.py")
+        # Neither `git clean` nor `git checkout` of the whole directory is needed
+        mock_run.assert_not_called()
+
+    @patch("subprocess.run")
+    def test_git_clean_no_tracked_changes(self, mock_run, hook, vendor_path):
+        """Test that no git command runs at all when vendoring didn't touch any tracked files."""
+        hook._determine_vendor_path()
+        (vendor_path / "urllib3").mkdir()
+        (vendor_path / "urllib3" / "__init__.py").write_text("# vendored\n")
+        (vendor_path / "six.py").write_text("# vendored\n")
+        # git status doesn't report empty directories, so this isn't in the recorded changes
+        (vendor_path / "emptydir").mkdir()
+        hook._vendored_changes = [
+            GitStatusEntry(FileStatus.UNTRACKED, "src/my_app/_vendor/urllib3/"),
+            GitStatusEntry(FileStatus.UNTRACKED, "src/my_app/_vendor/six.py"),
+        ]
+
+        hook._git_clean_vendor_dir()
+
+        mock_run.assert_not_called()
+        assert [f.name for f in vendor_path.iterdir()] == [".gitignore"]
+
+    def test_remove_untracked_paths(self, hook, project_dir, vendor_path):
+        """Test removing untracked files, directories and symlinks, and paths that have already gone."""
+        hook._determine_vendor_path()
+        (vendor_path / "urllib3").mkdir()
+        (vendor_path / "urllib3" / "__init__.py").write_text("# vendored\n")
+        (vendor_path / "six.py").write_text("# vendored\n")
+        (vendor_path / "link").symlink_to(project_dir / "src")
+
+        hook._remove_untracked_paths(
+            [
+                "src/my_app/_vendor/urllib3/",
+                "src/my_app/_vendor/six.py",
+                "src/my_app/_vendor/link",
+                "src/my_app/_vendor/gone.py",
+            ]
+        )
+
+        assert [f.name for f in vendor_path.iterdir()] == [".gitignore"]
+        # The symlink is removed, not what it points to
+        assert (project_dir / "src" / "my_app" / "__init__.py").exists()
+
+    def test_remove_untracked_paths_outside_vendor_dir(self, hook, project_dir):
+        """Test that a path outside of the vendor directory is never deleted."""
+        hook._determine_vendor_path()
+
+        with pytest.raises(RuntimeError, match="outside of"):
+            hook._remove_untracked_paths(["pyproject.toml"])
+
+        assert (project_dir / "pyproject.toml").exists()
+
+    def test_record_and_clean_vendored_changes(self, hook, vendor_path):
+        """Test that the changes recorded after vendoring are all cleaned up again."""
+        hook._determine_vendor_path()
+
+        # Simulate what vendoring does to the directory
+        (vendor_path / ".gitignore").write_text("*.pyc\n")
+        (vendor_path / "urllib3").mkdir()
+        (vendor_path / "urllib3" / "__init__.py").write_text("# vendored\n")
+        (vendor_path / "urllib3" / "__init__.pyc").write_text("")
+        (vendor_path / "six.py").write_text("# vendored\n")
+
+        hook._record_vendored_changes()
+        hook._git_clean_vendor_dir()
+
+        assert [f.name for f in vendor_path.iterdir()] == [".gitignore"]
+        assert (vendor_path / ".gitignore").read_text() == ""
+
+    def test_record_and_clean_vendored_changes_empty_dirs(self, hook, vendor_path):
+        """Test that empty directories left by vendoring, which git status never reports, are cleaned up too."""
+        hook._determine_vendor_path()
+
+        # Simulate vendoring leaving empty directories behind, e.g. after a `drop` pattern removed their contents
+        (vendor_path / "emptydir").mkdir()
+        (vendor_path / "urllib3" / "sub_empty" / "nested_empty").mkdir(parents=True)
+        (vendor_path / "six.py").write_text("# vendored\n")
+
+        hook._record_vendored_changes()
+        hook._git_clean_vendor_dir()
+
+        assert [f.name for f in vendor_path.iterdir()] == [".gitignore"]
+
+    def test_record_vendored_changes_git_not_installed(self, project_dir, vendor_path, monkeypatch):
+        """Test that a build which doesn't abort on changes carries on when git isn't installed."""
+        hook = VendoringBuildHook(project_dir, {"abort-on-changed-files": False}, {}, {}, None, "sdist")
+        hook._determine_vendor_path()
+        monkeypatch.setenv("PATH", "/nonexistent")
+
+        hook._record_vendored_changes()
+
+        assert hook._vendored_changes is None
+
+    def test_record_and_clean_vendored_changes_untracked_project(self, tmp_path):
+        """Test cleaning up when the whole project is in an untracked directory of the enclosing repository."""
+        subprocess.run(["git", "init", "-q"], cwd=tmp_path, check=True)
+        (tmp_path / "README.md").write_text("outer\n")
+        subprocess.run(["git", "add", "README.md"], cwd=tmp_path, check=True)
+        subprocess.run(
+            ["git", "-c", "user.name=Test User", "-c", "user.email=test@example.com", "commit", "-q", "-m", "Initial"],
+            cwd=tmp_path,
+            check=True,
+        )
+        project = tmp_path / "proj"
+        vendor_path = project / "src" / "a" / "_vendor"
+        vendor_path.mkdir(parents=True)
+        (project / "pyproject.toml").write_text('[tool.vendoring]\ndestination = "src/a/_vendor"\n')
+        hook = VendoringBuildHook(str(project), {}, {}, {}, None, "sdist")
+        hook._determine_vendor_path()
+
+        # Simulate what vendoring does to the directory
+        (vendor_path / "urllib3").mkdir()
+        (vendor_path / "urllib3" / "__init__.py").write_text("# vendored\n")
+
+        hook._record_vendored_changes()
+        hook._git_clean_vendor_dir()
+
+        assert not (vendor_path / "urllib3").exists()
+
+    def test_git_clean_whole_vendor_dir_git_not_installed(self, hook, vendor_path, monkeypatch):
+        """Test that finalize warns rather than crashes when there is a .git but git itself isn't installed."""
+        hook._determine_vendor_path()
+        (vendor_path / "six.py").write_text("# vendored\n")
+        monkeypatch.setenv("PATH", "/nonexistent")
+
+        # Should not raise, just warn
+        hook._git_clean_vendor_dir()
+
+        assert (vendor_path / "six.py").exists()
+
+    @patch.object(VendoringBuildHook, "_is_git_repo", new_callable=PropertyMock)
     def test_git_clean_not_git_repo(self, mock_is_git_repo, hook):
         """Test git cleaning when not in a git repo."""
         mock_is_git_repo.return_value = False
@@ -160,6 +407,25 @@ class TestVendoringBuildHook:
         # Should not raise, just warn
         hook._git_clean_vendor_dir()
 
+    @patch.object(VendoringBuildHook, "app", new_callable=PropertyMock)
+    @patch.object(VendoringBuildHook, "_is_git_repo", new_callable=PropertyMock)
+    @patch("hatch_build_time_vendoring.plugin.get_modified_and_untracked_files")
+    def test_check_for_uncommitted_changes_not_aborting(
+        self, mock_get_files, mock_is_git_repo, mock_app, project_dir, vendor_path
+    ):
+        """Test that git isn't consulted when uncommitted changes wouldn't abort the build, but their removal is noted."""
+        hook = VendoringBuildHook(project_dir, {"abort-on-changed-files": False}, {}, {}, None, "sdist")
+        hook._determine_vendor_path()
+        (vendor_path / "foo.py").write_text("Untracked content")
+
+        hook._check_for_uncommitted_changes()
+
+        mock_get_files.assert_not_called()
+        mock_is_git_repo.assert_not_called()
+        # Only a note, as this is printed on every such build whether or not anything changed
+        mock_app.return_value.display_warning.assert_not_called()
+        assert "will be removed or reverted after the build" in mock_app.return_value.display_info.call_args[0][0]
+
     @patch.object(VendoringBuildHook, "_run_vendoring")
     @patch.object(VendoringBuildHook, "_check_for_uncommitted_changes")
     def test_initialize(self, mock_check, mock_run, hook):
@@ -180,6 +446,18 @@ class TestVendoringBuildHook:
 
         mock_git_clean.assert_called_once()
 
+    @patch.object(VendoringBuildHook, "_git_clean_vendor_dir")
+    @patch("pathlib.Path.exists")
+    def test_finalize_vendored_changes_recorded(self, mock_exists, mock_git_clean, hook, vendor_path):
+        """Test that finalize doesn't look for the vendor directory again once the vendored changes are recorded."""
+        hook.vendor_path = vendor_path
+        hook._vendored_changes = []
+
+        hook.finalize("1.0.0", {}, "artifact.whl")
+
+        mock_exists.assert_not_called()
+        mock_git_clean.assert_called_once()
+
     @patch.object(VendoringBuildHook, "_git_clean_vendor_dir")
     @patch("pathlib.Path.exists")
     def test_finalize_no_vendor_path(self, mock_exists, mock_git_clean, hook):
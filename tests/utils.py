@@ -1,8 +1,31 @@
+import os
 import subprocess
 import sys
+import tempfile
+from pathlib import Path
 
 
-def build_project(*args):
-    process = subprocess.run([sys.executable, "-m", "build", *args], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    if process.returncode:  # no cov
-        raise Exception(process.stdout.decode("utf-8"))
+def build_project(*args, python=sys.executable, cwd=None):
+    """
+    Build the project in `cwd` (default: the current directory).
+
+    The build isn't isolated, it runs in the environment that `python` belongs to, which must already have the build
+    requirements installed -- see the `build_python` fixture.
+    """
+    # Put the environment's scripts first on PATH too, so that vendoring finds its `pip`
+    env = {**os.environ, "PATH": os.pathsep.join((str(Path(python).parent), os.environ.get("PATH", "")))}
+    # vendoring downloads into a fixed directory under the temp dir, so builds running at the same time (under
+    # pytest-xdist) need temp dirs of their own
+    with tempfile.TemporaryDirectory() as tmpdir, tempfile.TemporaryFile() as output:
+        env["TMPDIR"] = tmpdir
+        # The build output is only wanted if the build fails, so write it to a file rather than through a pipe
+        process = subprocess.run(
+            [python, "-m", "build", "--no-isolation", *args],
+            cwd=cwd,
+            env=env,
+            stdout=output,
+            stderr=subprocess.STDOUT,
+        )
+        if process.returncode:  # no cov
+            output.seek(0)
+            raise Exception(output.read().decode("utf-8"))